@@ -26,11 +26,22 @@ Example usage:
 
 import sys
 import os
+import concurrent.futures
+import functools
+import mmap
+import numpy
 import pandas
+import pyarrow
+import pyarrow.csv
 import subprocess
 import argparse
-from matplotlib import pyplot
-from matplotlib.pyplot import figure
+from pathlib import Path
+import matplotlib
+
+# Only savefig is used, so pick the Agg backend up front and skip any GUI
+# toolkit initialization on import
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt
 from enum import Enum
 
 parser = argparse.ArgumentParser(
@@ -66,22 +77,25 @@ parser.add_argument(
 )
 
 
+@functools.lru_cache(maxsize=None)
 def get_machine_mem() -> int:
     """
     Gets the RAM of the local machine.
 
+    The result is cached so repeated calls do not re-read /proc/meminfo.
+
     Args:
       None
 
     Returns:
       Integer representation of the local machine RAM in GBs
     """
-    mem_info = subprocess.run(
-        ["grep", "MemTotal", "/proc/meminfo"], stdout=subprocess.PIPE
-    ).stdout.split()
+    with open("/proc/meminfo") as f:
+        mem_info = f.readline().split()
     return int(int(mem_info[1]) / 1000000)
 
 
+@functools.lru_cache(maxsize=None)
 def get_machine_cpu() -> int:
     """
     Gets the CPU/number of cores of the local machine.
@@ -92,8 +106,7 @@ def get_machine_cpu() -> int:
     Returns:
       Integer representation of the number of cores of the local machine
     """
-    cpu_info = subprocess.run(["nproc"], stdout=subprocess.PIPE).stdout
-    return int(cpu_info)
+    return os.cpu_count()
 
 
 def monitor_pipeline_pidstat(
@@ -114,13 +127,12 @@ def monitor_pipeline_pidstat(
     Returns:
       None
     """
-    if not os.path.exists(output_results_path + str(data_description) + "/graphs"):
-        os.makedirs(output_results_path + str(data_description) + "/graphs")
-    if not os.path.exists(output_results_path + str(data_description) + "/tables"):
-        os.makedirs(output_results_path + str(data_description) + "/tables")
-    if not os.path.exists(output_results_path + str(data_description) + "/raw"):
-        os.makedirs(output_results_path + str(data_description) + "/raw")
-    subprocess.call(
+    base_path = Path(output_results_path, str(data_description))
+    for sub_dir in ("graphs", "tables", "raw"):
+        (base_path / sub_dir).mkdir(parents=True, exist_ok=True)
+    # Run the monitoring script without inheriting stdin and fail fast if it
+    # exits non-zero, so graphing is not attempted on missing raw files
+    subprocess.run(
         [
             "sh",
             "./monitor_pipeline.sh",
@@ -128,87 +140,93 @@ def monitor_pipeline_pidstat(
             data_description,
             output_parquet_path,
             output_results_path,
-        ]
+        ],
+        check=True,
+        stdin=subprocess.DEVNULL,
+        close_fds=True,
     )
 
 
-def make_pidstat_tables(file_name: str, type: str) -> pandas.DataFrame:
+def make_pidstat_tables(file_name: os.PathLike, type: str) -> pandas.DataFrame:
     """
     Creates pandas tables from raw pidstat data.
 
     Args:
-      file_name: Name of the .txt file containing raw pidstat output
+      file_name: Path of the .txt file containing raw pidstat output
       type: Type of the resource relevant to the table (Pipeline, Server, or DB)
 
     Returns:
       Pandas table with CPU, memory and I/O usage info for the resource.
     """
 
-    # Parse the raw .txt file into a pandas dataframe
-    total_usage = []
-    seconds_elapsed = 0
-
-    # Expected format of each transformation:
-    # 1. Read a line in the raw file
-    # 2. Transforms a line in the raw file to a list of strings.
-    # 3. Delete all elements before the %CPU column index
-    # 4. Delete all elements after the kB_wr/s column index
-    # 5. Delete all elements the %CPU and %MEM columns index
-    # 6. Insert the time elapsed (s) at the front of the list
-    with open(file_name) as f:
-        for line in f:
-            usage = []
-            if line[0].isdigit():
-                usage = line.split()
-
-                if type == "DB" and usage[-3] != "hapi":
-                    continue
-
-                del usage[:8]
-                del usage[9:]
-                del usage[1:6]
-                usage.insert(0, seconds_elapsed)
-                total_usage.append(usage)
-            elif line[0] == "#":
-                seconds_elapsed += 1
+    # Parse the raw .txt file into a pandas dataframe. Every line is
+    # classified by its first character: "#" starts the header of a new
+    # one-second pidstat sample and a leading digit starts a usage row.
+    # The file is memory-mapped so the decode reads straight from the page
+    # cache instead of an intermediate heap copy of the raw bytes.
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            lines = pandas.Series([], dtype=str)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as raw_map:
+                lines = pandas.Series(str(memoryview(raw_map), "utf-8").splitlines())
+    first_char = lines.str[:1]
+
+    # Number each usage row with the count of sample headers seen before it
+    seconds_elapsed = numpy.cumsum((first_char == "#").to_numpy())
+    usage_mask = ((first_char >= "0") & (first_char <= "9")).to_numpy()
+    tokens = lines[usage_mask].str.split()
+    seconds_elapsed = seconds_elapsed[usage_mask]
+
+    # Only keep the usage rows of the "hapi" connections for the DB table.
+    # The command tokens take only a handful of distinct values, so comparing
+    # them as a categorical turns the string match into an integer code match
+    if type == "DB":
+        hapi_mask = (tokens.str[-3].astype("category") == "hapi").to_numpy()
+        tokens = tokens[hapi_mask]
+        seconds_elapsed = seconds_elapsed[hapi_mask]
 
+    # Token positions 8, 14, 15 and 16 of a usage row hold the %CPU, %MEM,
+    # kB_rd/s and kB_wr/s columns of the raw pidstat output
     total_usage_df = pandas.DataFrame(
-        total_usage,
-        columns=[
-            "Seconds Elapsed",
-            type + " %CPU",
-            type + " MEM",
-            type + " kBs Read / Second",
-            type + " kBs Written / Second",
-        ],
-    )
-    total_usage_df[type + " MEM"] = total_usage_df[type + " MEM"].apply(
-        lambda x: float(x) / 100 * get_machine_mem()
-    )
-
-    # Cast types of all columns
-    for col in total_usage_df:
-        total_usage_df[col] = total_usage_df[col].astype(float)
-
-    # Summation by the second for the database table
+        {
+            "Seconds Elapsed": seconds_elapsed,
+            type + " %CPU": tokens.str[8].to_numpy(),
+            type + " MEM": tokens.str[14].to_numpy(),
+            type + " kBs Read / Second": tokens.str[15].to_numpy(),
+            type + " kBs Written / Second": tokens.str[16].to_numpy(),
+        }
+    )
+    # Cast types of all columns in one pass; float32 has plenty of precision
+    # for pidstat percentages and kB/s rates and halves the memory traffic of
+    # everything downstream
+    total_usage_df = total_usage_df.astype(
+        {
+            "Seconds Elapsed": numpy.int32,
+            type + " %CPU": numpy.float32,
+            type + " MEM": numpy.float32,
+            type + " kBs Read / Second": numpy.float32,
+            type + " kBs Written / Second": numpy.float32,
+        }
+    )
+
+    # Convert the %MEM column to GBs with one vectorized multiply
+    total_usage_df[type + " MEM"] = (
+        total_usage_df[type + " MEM"] / 100 * get_machine_mem()
+    )
+
+    # Summation by the second for the database table; the seconds counter is
+    # already monotonically non-decreasing, so the groupby does not need a sort
     if type == "DB":
-        total_usage_df["DB %CPU"] = total_usage_df.groupby(["Seconds Elapsed"])[
-            "DB %CPU"
-        ].transform(sum)
-        total_usage_df["DB MEM"] = total_usage_df.groupby(["Seconds Elapsed"])[
-            "DB MEM"
-        ].transform(sum)
-        total_usage_df["DB kBs Written / Second"] = total_usage_df.groupby(
-            ["Seconds Elapsed"]
-        )["DB kBs Written / Second"].transform(sum)
-        total_usage_df["DB kBs Read / Second"] = total_usage_df.groupby(
-            ["Seconds Elapsed"]
-        )["DB kBs Read / Second"].transform(sum)
-        total_usage_df = total_usage_df.drop_duplicates(subset=["Seconds Elapsed"])
+        total_usage_df = total_usage_df.groupby(
+            "Seconds Elapsed", as_index=False, sort=False
+        ).sum()
 
-    total_usage_df[total_usage_df < 0] = 0
+    # Floor negative readings at zero without materializing a full-frame
+    # boolean mask
+    total_usage_df = total_usage_df.clip(lower=0)
 
-    return total_usage_df
+    return total_usage_df.set_index("Seconds Elapsed")
 
 
 def graph_pidstat(
@@ -226,261 +244,151 @@ def graph_pidstat(
       None
     """
 
-    # Create pandas dataframes for all resource types and merge into one big dataframe
-    pipeline_df = make_pidstat_tables(
-        output_results_path
-        + str(data_description)
-        + "/raw/pipeline_stats_"
-        + str(num_proc)
-        + "_proc.txt",
-        "Pipeline",
-    )
-    server_df = make_pidstat_tables(
-        output_results_path
-        + str(data_description)
-        + "/raw/server_stats_"
-        + str(num_proc)
-        + "_proc.txt",
-        "Server",
-    )
-    db_df = make_pidstat_tables(
-        output_results_path
-        + str(data_description)
-        + "/raw/database_stats_"
-        + str(num_proc)
-        + "_proc.txt",
-        "DB",
-    )
-    all_stats_df = pandas.merge(pipeline_df, server_df, on="Seconds Elapsed")
-    all_stats_df = pandas.merge(all_stats_df, db_df, on="Seconds Elapsed")
-
-    # Generate graphs with resource usage information
-    figure(figsize=(32, 20), dpi=80)
-    pyplot.subplot(3, 1, 1)
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Pipeline %CPU"],
-        "-o",
-        label="Pipeline",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Server %CPU"],
-        "-o",
-        label="Server",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"], all_stats_df["DB %CPU"], "-o", label="DB"
-    )
-    pyplot.ylabel("%CPU Usage", fontsize=14)
-    pyplot.legend()
-    pyplot.title("Pipeline vs Server vs Database %CPU Usage", fontsize=14)
-
-    pyplot.subplot(3, 1, 2)
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Pipeline MEM"],
-        "-o",
-        label="Pipeline",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Server MEM"],
-        "-o",
-        label="Server",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"], all_stats_df["DB MEM"], "-o", label="DB"
-    )
-    pyplot.ylabel("MEM Usage (GB)", fontsize=14)
-    pyplot.legend()
-    pyplot.title("Pipeline vs Server vs Database MEM Usage", fontsize=14)
-
-    pyplot.subplot(3, 1, 3)
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Pipeline kBs Written / Second"],
-        "-o",
-        label="Pipeline kBs Written / s",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Server kBs Written / Second"],
-        "-o",
-        label="Server kBs Written / s",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["DB kBs Written / Second"],
-        "-o",
-        label="DB kBs Written / s",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Pipeline kBs Read / Second"],
-        "-o",
-        label="Pipeline kBs Read / s",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["Server kBs Read / Second"],
-        "-o",
-        label="Server kBs Read / s",
-    )
-    pyplot.plot(
-        all_stats_df["Seconds Elapsed"],
-        all_stats_df["DB kBs Read / Second"],
-        "-o",
-        label="DB kBs Read / s",
+    # Convert the arguments to strings once instead of at every use
+    num_proc_s = str(num_proc)
+    data_description_s = str(data_description)
+    base_path = Path(output_results_path, data_description_s)
+    raw_path = base_path / "raw"
+
+    # Create pandas dataframes for all resource types and merge into one big
+    # dataframe; the three raw files are independent, so they are parsed in
+    # parallel worker threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        pipeline_df, server_df, db_df = executor.map(
+            make_pidstat_tables,
+            [
+                raw_path / f"pipeline_stats_{num_proc_s}_proc.txt",
+                raw_path / f"server_stats_{num_proc_s}_proc.txt",
+                raw_path / f"database_stats_{num_proc_s}_proc.txt",
+            ],
+            ["Pipeline", "Server", "DB"],
+        )
+    # All three tables are indexed by the same per-second grid, so an aligned
+    # concat replaces the pairwise hash joins
+    all_stats_df = pandas.concat(
+        [pipeline_df, server_df, db_df], axis=1, join="inner"
+    ).reset_index()
+
+    # Generate graphs with resource usage information. Each subplot draws all
+    # of its series with one plot call on a 2D array, and the markers are
+    # decimated so long runs do not rasterize one marker per sample
+    seconds = all_stats_df["Seconds Elapsed"].to_numpy()
+    mark_every = max(1, len(seconds) // 200)
+
+    fig, (ax_cpu, ax_mem, ax_io) = plt.subplots(3, 1, figsize=(32, 20), dpi=80)
+    ax_cpu.plot(
+        seconds,
+        all_stats_df[["Pipeline %CPU", "Server %CPU", "DB %CPU"]].to_numpy(),
+        marker="o",
+        markevery=mark_every,
+    )
+    ax_cpu.set_ylabel("%CPU Usage", fontsize=14)
+    ax_cpu.legend(["Pipeline", "Server", "DB"])
+    ax_cpu.set_title("Pipeline vs Server vs Database %CPU Usage", fontsize=14)
+
+    ax_mem.plot(
+        seconds,
+        all_stats_df[["Pipeline MEM", "Server MEM", "DB MEM"]].to_numpy(),
+        marker="o",
+        markevery=mark_every,
+    )
+    ax_mem.set_ylabel("MEM Usage (GB)", fontsize=14)
+    ax_mem.legend(["Pipeline", "Server", "DB"])
+    ax_mem.set_title("Pipeline vs Server vs Database MEM Usage", fontsize=14)
+
+    ax_io.plot(
+        seconds,
+        all_stats_df[
+            [
+                "Pipeline kBs Written / Second",
+                "Server kBs Written / Second",
+                "DB kBs Written / Second",
+                "Pipeline kBs Read / Second",
+                "Server kBs Read / Second",
+                "DB kBs Read / Second",
+            ]
+        ].to_numpy(),
+        marker="o",
+        markevery=mark_every,
+    )
+    ax_io.set_ylabel("I/O Usage (kBs/s)", fontsize=14)
+    ax_io.set_xlabel("Seconds Elapsed", fontsize=14)
+    ax_io.legend(
+        [
+            "Pipeline kBs Written / s",
+            "Server kBs Written / s",
+            "DB kBs Written / s",
+            "Pipeline kBs Read / s",
+            "Server kBs Read / s",
+            "DB kBs Read / s",
+        ]
     )
-    pyplot.ylabel("I/O Usage (kBs/s)", fontsize=14)
-    pyplot.xlabel("Seconds Elapsed", fontsize=14)
-    pyplot.title("Pipeline vs Server vs DB I/O Usage", fontsize=14)
-
-    pyplot.text(
+    ax_io.set_title("Pipeline vs Server vs DB I/O Usage", fontsize=14)
+
+    # Pre-compute all summary statistics in a single pass over the dataframe
+    means = all_stats_df.mean().to_dict()
+    total_seconds = int(all_stats_df["Seconds Elapsed"].max())
+
+    # Render the whole summary with two text calls (heading plus one
+    # multi-line block) instead of one per statistic
+    summary_lines = [
+        f"Total time: {total_seconds} s",
+        f"Avg. pipeline %CPU: {round(means['Pipeline %CPU'], 1)}",
+        f"Avg. server %CPU: {round(means['Server %CPU'], 1)}",
+        f"Avg. database %CPU: {round(means['DB %CPU'], 1)}",
+        f"Avg. pipeline MEM: {round(means['Pipeline MEM'], 1)} GB",
+        f"Avg. server MEM: {round(means['Server MEM'], 1)} GB",
+        f"Avg. database MEM: {round(means['DB MEM'], 1)} GB",
+        f"Avg. pipeline read: {round(means['Pipeline kBs Read / Second'], 1)} kBs/s",
+        f"Avg. server read: {round(means['Server kBs Read / Second'], 1)} kBs/s",
+        f"Avg. database read: {round(means['DB kBs Read / Second'], 1)} kBs/s",
+        f"Avg. pipeline write: {round(means['Pipeline kBs Written / Second'], 1)} kBs/s",
+        f"Avg. server write: {round(means['Server kBs Written / Second'], 1)} kBs/s",
+        f"Avg. database write: {round(means['DB kBs Written / Second'], 1)} kBs/s",
+    ]
+    fig.text(
         0.005,
         0.645,
         "Run Summary",
         fontsize=14,
         weight="bold",
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.62,
-        "Total time: " + str(int(all_stats_df["Seconds Elapsed"].max())) + " s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.60,
-        "Avg. pipeline %CPU: " + str(round(all_stats_df["Pipeline %CPU"].mean(), 1)),
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.58,
-        "Avg. server %CPU: " + str(round(all_stats_df["Server %CPU"].mean(), 1)),
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.56,
-        "Avg. database %CPU: " + str(round(all_stats_df["DB %CPU"].mean(), 1)),
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.54,
-        "Avg. pipeline MEM: "
-        + str(round(all_stats_df["Pipeline MEM"].mean(), 1))
-        + " GB",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.52,
-        "Avg. server MEM: " + str(round(all_stats_df["Server MEM"].mean(), 1)) + " GB",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.5,
-        "Avg. database MEM: " + str(round(all_stats_df["DB MEM"].mean(), 1)) + " GB",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
     )
-    pyplot.text(
+    fig.text(
         0.005,
-        0.48,
-        "Avg. pipeline read: "
-        + str(round(all_stats_df["Pipeline kBs Read / Second"].mean(), 1))
-        + " kBs/s",
+        0.635,
+        "\n".join(summary_lines),
         fontsize=12,
-        transform=pyplot.gcf().transFigure,
+        verticalalignment="top",
     )
-    pyplot.text(
-        0.005,
-        0.46,
-        "Avg. server read: "
-        + str(round(all_stats_df["Server kBs Read / Second"].mean(), 1))
-        + " kBs/s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.44,
-        "Avg. database read: "
-        + str(round(all_stats_df["DB kBs Read / Second"].mean(), 1))
-        + " kBs/s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.42,
-        "Avg. pipeline write: "
-        + str(round(all_stats_df["Pipeline kBs Written / Second"].mean(), 1))
-        + " kBs/s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.40,
-        "Avg. server write: "
-        + str(round(all_stats_df["Server kBs Written / Second"].mean(), 1))
-        + " kBs/s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.text(
-        0.005,
-        0.38,
-        "Avg. database write: "
-        + str(round(all_stats_df["DB kBs Written / Second"].mean(), 1))
-        + " kBs/s",
-        fontsize=12,
-        transform=pyplot.gcf().transFigure,
-    )
-    pyplot.suptitle(
+    fig.suptitle(
         "Resource Usage of Batch Pipeline with HAPI as the Source on Local Machine ("
         + str(get_machine_cpu())
         + " "
         + "CPU, "
         + str(get_machine_mem())
         + " GB RAM, "
-        + str(num_proc)
+        + num_proc_s
         + " proc, "
-        + str(data_description)
+        + data_description_s
         + " data)",
         fontsize=16,
         weight="bold",
     )
-    pyplot.legend()
 
     # Save the graph and csv files
-    pyplot.savefig(
-        output_results_path
-        + str(data_description)
-        + "/graphs/resource_usage_"
-        + str(num_proc)
-        + "_proc.png"
-    )
-    all_stats_df.to_csv(
-        output_results_path
-        + str(data_description)
-        + "/tables/resource_usage_"
-        + str(num_proc)
-        + "_proc.csv",
-        encoding="utf-8",
+    fig.savefig(base_path / "graphs" / f"resource_usage_{num_proc_s}_proc.png")
+    plt.close(fig)
+    # pyarrow's multithreaded csv writer formats the floats much faster than
+    # DataFrame.to_csv
+    pyarrow.csv.write_csv(
+        pyarrow.Table.from_pandas(all_stats_df, preserve_index=False),
+        base_path / "tables" / f"resource_usage_{num_proc_s}_proc.csv",
+    )
+    # Also keep a compressed columnar copy so downstream analysis can read the
+    # table back with column pruning instead of re-parsing the csv
+    all_stats_df.to_parquet(
+        base_path / "tables" / f"resource_usage_{num_proc_s}_proc.parquet",
+        compression="zstd",
         index=False,
     )
 